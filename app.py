@@ -2,7 +2,8 @@ import streamlit as st
 from supabase import create_client
 from streamlit_searchbox import st_searchbox
 import pandas as pd
-from datetime import date
+import calendar
+from datetime import date, timedelta
 from io import BytesIO
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
@@ -22,22 +23,125 @@ st.set_page_config(page_title="Gas Cylinder Manager", layout="centered")
 def get_shops():
     return supabase.table("shops").select("*").order("shop_name").execute().data
 
-def get_shop_cumulative(shop_id):
-    data = supabase.table("daily_transactions") \
-        .select("cylinders_delivered, empty_cylinders_received, balance_after_transaction") \
-        .eq("shop_id", shop_id) \
-        .order("transaction_date") \
-        .execute().data
+# Month-end checkpoints of each shop's running totals, so balance lookups and
+# recomputes replay only the rows after the nearest checkpoint.
+# Table: shop_balance_checkpoints(shop_id, checkpoint_date, cylinders_delivered,
+#        empty_cylinders_received, closing_balance), unique (shop_id, checkpoint_date)
+CHECKPOINT_TABLE = "shop_balance_checkpoints"
+
+def month_end(d):
+    return d.replace(day=calendar.monthrange(d.year, d.month)[1])
+
+def get_transactions(shop_id, after=None, upto=None):
+    q = supabase.table("daily_transactions").select("*").eq("shop_id", shop_id)
+    if after:
+        q = q.gt("transaction_date", after)
+    if upto:
+        q = q.lte("transaction_date", upto)
+    return q.order("transaction_date").order("transaction_id").execute().data
+
+def get_checkpoint_before(shop_id, before_date=None):
+    q = supabase.table(CHECKPOINT_TABLE).select("*").eq("shop_id", shop_id)
+    if before_date:
+        q = q.lt("checkpoint_date", before_date.isoformat())
+    data = q.order("checkpoint_date", desc=True).limit(1).execute().data
+    return data[0] if data else None
+
+def checkpoint_state(cp):
+    if not cp:
+        return 0, 0, 0
+    return cp["cylinders_delivered"], cp["empty_cylinders_received"], cp["closing_balance"]
+
+def txn_amount_due(t):
+    return t["cylinders_delivered"] * t["price_per_cylinder"] - t["payment_cash"] - t["payment_upi"]
+
+def get_shop_cumulative(shop_id, on_date=None):
+    # Totals up to and including on_date (all history if None), starting from the
+    # nearest checkpoint instead of the shop's first transaction.
+    cp = get_checkpoint_before(shop_id, on_date + timedelta(days=1) if on_date else None)
+    delivered, empty, balance = checkpoint_state(cp)
+    data = get_transactions(
+        shop_id,
+        after=cp["checkpoint_date"] if cp else None,
+        upto=on_date.isoformat() if on_date else None
+    )
 
     if not data:
-        return 0, 0, 0
+        return delivered, empty, balance
 
     return (
-        sum(d["cylinders_delivered"] for d in data),
-        sum(d["empty_cylinders_received"] for d in data),
+        delivered + sum(d["cylinders_delivered"] for d in data),
+        empty + sum(d["empty_cylinders_received"] for d in data),
         data[-1]["balance_after_transaction"]
     )
 
+def close_checkpoints(shop_id):
+    # Checkpoint every completed month after the latest existing checkpoint
+    cp = get_checkpoint_before(shop_id)
+    delivered, empty, balance = checkpoint_state(cp)
+    txns = get_transactions(
+        shop_id,
+        after=cp["checkpoint_date"] if cp else None,
+        upto=(date.today().replace(day=1) - timedelta(days=1)).isoformat()
+    )
+
+    rows = []
+    for t in txns:
+        cp_date = month_end(date.fromisoformat(t["transaction_date"][:10])).isoformat()
+        if not rows or rows[-1]["checkpoint_date"] != cp_date:
+            rows.append({"shop_id": shop_id, "checkpoint_date": cp_date})
+        delivered += t["cylinders_delivered"]
+        empty += t["empty_cylinders_received"]
+        balance += txn_amount_due(t)
+        rows[-1].update({
+            "cylinders_delivered": delivered,
+            "empty_cylinders_received": empty,
+            "closing_balance": balance
+        })
+
+    if rows:
+        supabase.table(CHECKPOINT_TABLE).upsert(rows, on_conflict="shop_id,checkpoint_date").execute()
+    return len(rows)
+
+def recalc_shop_balances(shop_id, from_date):
+    # Checkpoints on or after from_date are stale; replay from the one before it
+    supabase.table(CHECKPOINT_TABLE).delete() \
+        .eq("shop_id", shop_id) \
+        .gte("checkpoint_date", from_date.isoformat()) \
+        .execute()
+
+    cp = get_checkpoint_before(shop_id, from_date)
+    _, _, balance = checkpoint_state(cp)
+    for t in get_transactions(shop_id, after=cp["checkpoint_date"] if cp else None):
+        balance += txn_amount_due(t)
+        supabase.table("daily_transactions").update({"balance_after_transaction": balance}).eq("transaction_id", t["transaction_id"]).execute()
+
+    close_checkpoints(shop_id)
+
+def verify_checkpoints(shop_id):
+    # Replay raw rows from zero and report checkpoints that no longer match
+    cps = supabase.table(CHECKPOINT_TABLE).select("*").eq("shop_id", shop_id).order("checkpoint_date").execute().data
+    txns = get_transactions(shop_id)
+
+    drift = []
+    delivered = empty = balance = 0
+    i = 0
+    for cp in cps:
+        while i < len(txns) and txns[i]["transaction_date"][:10] <= cp["checkpoint_date"]:
+            delivered += txns[i]["cylinders_delivered"]
+            empty += txns[i]["empty_cylinders_received"]
+            balance += txn_amount_due(txns[i])
+            i += 1
+        if (cp["cylinders_delivered"], cp["empty_cylinders_received"]) != (delivered, empty) \
+                or round(cp["closing_balance"] - balance, 2) != 0:
+            drift.append({
+                "checkpoint_date": cp["checkpoint_date"],
+                "delivered (checkpoint / raw)": f"{cp['cylinders_delivered']} / {delivered}",
+                "empty (checkpoint / raw)": f"{cp['empty_cylinders_received']} / {empty}",
+                "balance (checkpoint / raw)": f"{cp['closing_balance']} / {balance}"
+            })
+    return drift
+
 def whatsapp_send(msg, phone):
     components.html(
         f"""
@@ -201,6 +305,7 @@ menu = st.sidebar.radio(
         "📊 Purchase Report",
         "📊 Expense Report",
         "✏️ Edit / Delete Entry",
+        "🧮 Balance Checkpoints",
         "🏪 Manage Shops"
     ]
 )
@@ -266,6 +371,7 @@ if menu == "🚚 Deliver Cylinders":
             "payment_upi": upi,
             "balance_after_transaction": new_balance
         }).execute()
+        close_checkpoints(shop["shop_id"])
         st.success("Delivery saved")
 
 # =====================================================
@@ -576,35 +682,75 @@ elif menu == "✏️ Edit / Delete Entry":
                     "payment_cash": cash,
                     "payment_upi": upi
                 }).eq("transaction_id", row["transaction_id"]).execute()
-                # Recalculate balance for this shop after update
-                # (Assume recalc_balance is not defined, so recalculate manually)
-                txns2 = supabase.table("daily_transactions").select("*").eq("shop_id", shop["shop_id"]).order("transaction_date").execute().data
-                if txns2:
-                    txns2 = sorted(txns2, key=lambda x: x["transaction_date"])
-                    balance = 0
-                    for t in txns2:
-                        t["total_amount"] = t["cylinders_delivered"] * t["price_per_cylinder"]
-                        paid = t["payment_cash"] + t["payment_upi"]
-                        balance = balance + t["total_amount"] - paid
-                        supabase.table("daily_transactions").update({"balance_after_transaction": balance}).eq("transaction_id", t["transaction_id"]).execute()
+                # Recalculate balance for this shop from the nearest checkpoint
+                recalc_shop_balances(shop["shop_id"], row["transaction_date"])
                 st.success("Updated")
                 st.rerun()
 
             if col2.form_submit_button("Delete"):
                 supabase.table("daily_transactions").delete().eq("transaction_id", row["transaction_id"]).execute()
                 # Recalculate balance for this shop after delete
-                txns2 = supabase.table("daily_transactions").select("*").eq("shop_id", shop["shop_id"]).order("transaction_date").execute().data
-                if txns2:
-                    txns2 = sorted(txns2, key=lambda x: x["transaction_date"])
-                    balance = 0
-                    for t in txns2:
-                        t["total_amount"] = t["cylinders_delivered"] * t["price_per_cylinder"]
-                        paid = t["payment_cash"] + t["payment_upi"]
-                        balance = balance + t["total_amount"] - paid
-                        supabase.table("daily_transactions").update({"balance_after_transaction": balance}).eq("transaction_id", t["transaction_id"]).execute()
+                recalc_shop_balances(shop["shop_id"], row["transaction_date"])
                 st.success("Deleted")
                 st.rerun()
 
+# =========================================================
+# 🧮 BALANCE CHECKPOINTS
+# =========================================================
+elif menu == "🧮 Balance Checkpoints":
+    st.header("🧮 Balance Checkpoints")
+
+    def search_shops(query):
+        return [name for name in shop_names if query.lower() in name.lower()]
+
+    shop_name = st_searchbox(
+        search_function=search_shops,
+        placeholder="Type or select shop name",
+        label="Select Shop",
+        key="checkpoint_shop_searchbox"
+    )
+    if not shop_name:
+        st.warning("Please select a shop to proceed.")
+        st.stop()
+    shop = shop_map[shop_name]
+
+    # -------- Balance on a date --------
+    on_date = st.date_input("Balance As On", date.today(), key="checkpoint_on_date")
+    delivered, empty, balance = get_shop_cumulative(shop["shop_id"], on_date)
+
+    st.subheader("📌 Position As On " + on_date.strftime("%d-%m-%Y"))
+    st.metric("Cylinders Delivered", int(delivered))
+    st.metric("Empty Received", int(empty))
+    st.metric("Empty Yet to be Received", int(delivered - empty))
+    st.metric("Balance", f"Rs. {balance:.2f}")
+
+    # -------- Checkpoints --------
+    st.subheader("📄 Monthly Checkpoints")
+    cps = supabase.table(CHECKPOINT_TABLE).select("*").eq("shop_id", shop["shop_id"]).order("checkpoint_date").execute().data
+    if cps:
+        st.dataframe(pd.DataFrame(cps), use_container_width=True)
+    else:
+        st.info("No checkpoints yet")
+
+    col1, col2, col3 = st.columns(3)
+    if col1.button("Close Months", key="checkpoint_close"):
+        added = sum(close_checkpoints(s["shop_id"]) for s in shops)
+        st.success(f"{added} checkpoints written")
+        st.rerun()
+
+    if col2.button("Verify", key="checkpoint_verify"):
+        drift = verify_checkpoints(shop["shop_id"])
+        if drift:
+            st.error(f"{len(drift)} checkpoints do not match the daily entries")
+            st.dataframe(pd.DataFrame(drift), use_container_width=True)
+        else:
+            st.success("Checkpoints match the daily entries")
+
+    if col3.button("Rebuild", key="checkpoint_rebuild"):
+        recalc_shop_balances(shop["shop_id"], date.min)
+        st.success("Balances and checkpoints rebuilt")
+        st.rerun()
+
 
 # =========================================================
 # 🏪 MANAGE SHOPS (EDIT/DELETE)